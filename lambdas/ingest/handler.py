@@ -6,6 +6,13 @@ from typing import Dict, Any
 
 import boto3
 
+try:
+    from profiling import profiled
+except ModuleNotFoundError as e:  # imported as a package (tests / local runs)
+    if e.name != "profiling":
+        raise
+    from lambdas.shared.profiling import profiled
+
 DIARY_BUCKET = os.environ.get("DIARY_BUCKET", "your-diary-bucket-name")
 s3 = boto3.client("s3")
 
@@ -80,6 +87,7 @@ def persist_to_s3(obj: Dict[str, Any], key_prefix: str = "diary") -> str:
     return key
 
 
+@profiled("ingest")
 def lambda_handler(event, context):
     """
     AWS Lambda handler for GAIA CODE ingest pipeline.
@@ -88,7 +96,8 @@ def lambda_handler(event, context):
     
     Input:
         {
-          "region_id": "reef_sumatra"  # optional, defaults to "reef_sumatra"
+          "region_id": "reef_sumatra",  # optional, defaults to "reef_sumatra"
+          "profile": true  # optional, profile this invocation (see PROFILE_* env vars)
         }
     
     Output:
@@ -3,10 +3,38 @@ import boto3
 import os
 from datetime import datetime, timezone
 
+try:
+    from hedging import HedgingPolicy
+except ModuleNotFoundError as e:  # imported as a package (tests / local runs)
+    if e.name != "hedging":
+        raise
+    from lambdas.narrative.hedging import HedgingPolicy
+
+try:
+    from profiling import profiled
+except ModuleNotFoundError as e:  # imported as a package (tests / local runs)
+    if e.name != "profiling":
+        raise
+    from lambdas.shared.profiling import profiled
+
 s3 = boto3.client("s3")
 bedrock = boto3.client("bedrock-runtime", region_name=os.environ.get("AWS_REGION", "us-east-1"))
+# Module-level so latency samples and hedge counters survive warm invocations
+hedging = HedgingPolicy.from_env()
+
+
+def invoke_bedrock(model_id, body):
+    """Call Bedrock and return the decoded response (body read included in latency)."""
+    resp = bedrock.invoke_model(
+        modelId=model_id,
+        contentType="application/json",
+        accept="application/json",
+        body=body
+    )
+    return json.loads(resp["body"].read())
 
 
+@profiled("narrative")
 def lambda_handler(event, context):
     """
     AWS Lambda handler for GAIA CODE narrative generation.
@@ -73,14 +101,13 @@ def lambda_handler(event, context):
             "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}]
         })
         
-        resp = bedrock.invoke_model(
-            modelId=os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0"),
-            contentType="application/json",
-            accept="application/json",
-            body=body
+        result, model_id = hedging.invoke(
+            lambda m: invoke_bedrock(m, body),
+            os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
         )
+        if hedging.enabled:
+            print(json.dumps({"stage": "bedrock_hedging", "model": model_id, **hedging.stats()}))
         
-        result = json.loads(resp["body"].read())
         text = result["content"][0]["text"].strip()
         
         # Calculate confidence (simple heuristic based on events)
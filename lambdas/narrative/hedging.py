@@ -0,0 +1,188 @@
+"""
+Hedged Bedrock requests for the narrative Lambda.
+
+A single slow invoke_model call sets the wall-clock time of a whole
+multi-region Step Functions run. When enabled, the policy starts a second
+request if the first has not finished by a tracked latency percentile, takes
+whichever returns first and discards the other.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from percentiles import nearest_rank
+except ModuleNotFoundError as e:  # imported as a package (tests / local runs)
+    if e.name != "percentiles":
+        raise
+    from lambdas.shared.percentiles import nearest_rank
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies (seconds)."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of the window, or None when empty."""
+        with self._lock:
+            samples = list(self._samples)
+        return nearest_rank(samples, pct)
+
+
+class HedgingPolicy:
+    """
+    Issue a backup request when the primary is slower than the tracked percentile.
+
+    Until `min_samples` latencies have been observed the hedge fires after
+    `initial_delay_s`. Hedges are capped at `max_hedge_pct` percent of calls
+    seen by this policy (i.e. per warm Lambda container).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        max_hedge_pct: float = 10.0,
+        fallback_model_id: Optional[str] = None,
+        initial_delay_s: float = 2.0,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_hedge_pct = max_hedge_pct
+        self.fallback_model_id = fallback_model_id
+        self.initial_delay_s = initial_delay_s
+        self.min_samples = min_samples
+        self.window = window
+        # One window per model so a faster fallback doesn't drag the primary's percentile down
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+
+    @classmethod
+    def from_env(cls) -> "HedgingPolicy":
+        """Build the policy from BEDROCK_HEDGE_* environment variables."""
+        enabled = os.environ.get("BEDROCK_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+        initial_delay_ms = float(os.environ.get("BEDROCK_HEDGE_INITIAL_DELAY_MS", "2000"))
+        return cls(
+            enabled=enabled,
+            percentile=float(os.environ.get("BEDROCK_HEDGE_PERCENTILE", "95")),
+            max_hedge_pct=float(os.environ.get("BEDROCK_HEDGE_MAX_PCT", "10")),
+            fallback_model_id=os.environ.get("BEDROCK_FALLBACK_MODEL_ID") or None,
+            initial_delay_s=initial_delay_ms / 1000.0,
+            min_samples=int(os.environ.get("BEDROCK_HEDGE_MIN_SAMPLES", "20")),
+        )
+
+    def tracker(self, model_id: str) -> LatencyTracker:
+        """Latency window for `model_id`, created on first use."""
+        with self._lock:
+            if model_id not in self.latencies:
+                self.latencies[model_id] = LatencyTracker(self.window)
+            return self.latencies[model_id]
+
+    def hedge_delay(self, model_id: str) -> float:
+        """Seconds to wait on a `model_id` primary before hedging."""
+        tracker = self.tracker(model_id)
+        if tracker.count() < self.min_samples:
+            return self.initial_delay_s
+        return tracker.percentile(self.percentile)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_issued": self.hedges_issued,
+                "hedges_won": self.hedges_won,
+            }
+
+    def _try_acquire_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges_issued < self.max_hedge_pct / 100.0 * self.requests:
+                self.hedges_issued += 1
+                return True
+            return False
+
+    def _submit(self, executor: ThreadPoolExecutor, call: Callable[[str], Any], model_id: str):
+        attempt = {"model_id": model_id, "start": time.monotonic(), "end": None}
+        attempt["future"] = executor.submit(call, model_id)
+        attempt["future"].add_done_callback(lambda f: attempt.update(end=time.monotonic()))
+        return attempt
+
+    def _record(self, attempts) -> None:
+        """
+        Feed each attempt's latency into its model's window as `invoke` returns.
+
+        A request still in flight is recorded as censored at the elapsed time so
+        far. Its real completion may only happen after the Lambda process thaws
+        for a later invocation, which would count the frozen gap as latency.
+        """
+        now = time.monotonic()
+        for attempt in attempts:
+            future = attempt["future"]
+            if not future.done():
+                self.tracker(attempt["model_id"]).record(now - attempt["start"])
+            elif not future.cancelled() and future.exception() is None:
+                end = attempt["end"] or now
+                self.tracker(attempt["model_id"]).record(end - attempt["start"])
+
+    def invoke(self, call: Callable[[str], Any], model_id: str) -> Tuple[Any, str]:
+        """
+        Run `call(model_id)`, hedging if it is slow.
+
+        Returns (result, model_id_that_answered). If every attempt fails the
+        primary's exception is raised.
+        """
+        with self._lock:
+            self.requests += 1
+
+        if not self.enabled:
+            start = time.monotonic()
+            result = call(model_id)
+            self.tracker(model_id).record(time.monotonic() - start)
+            return result, model_id
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        primary = self._submit(executor, call, model_id)
+        attempts = [primary]
+        try:
+            done, _ = wait([primary["future"]], timeout=self.hedge_delay(model_id))
+            if done or not self._try_acquire_hedge():
+                return primary["future"].result(), model_id
+
+            hedge = self._submit(executor, call, self.fallback_model_id or model_id)
+            attempts.append(hedge)
+            pending = {a["future"]: a for a in attempts}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempt = pending.pop(future)
+                    if future.exception() is None:
+                        for other in pending:
+                            other.cancel()
+                        if attempt is hedge:
+                            with self._lock:
+                                self.hedges_won += 1
+                        return future.result(), attempt["model_id"]
+            return primary["future"].result(), model_id
+        finally:
+            self._record(attempts)
+            # Don't block on the discarded request; it finishes (or not) on its own thread.
+            executor.shutdown(wait=False)
@@ -0,0 +1,15 @@
+"""
+Percentile helpers shared by the GAIA Lambdas.
+"""
+
+import math
+from typing import Iterable, Optional
+
+
+def nearest_rank(values: Iterable[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of `values`, or None when there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
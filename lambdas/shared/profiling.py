@@ -0,0 +1,369 @@
+"""
+Opt-in per-invocation profiling for the GAIA Lambda handlers.
+
+Wrap a handler with `@profiled("ingest")`. A sampled fraction of invocations
+(PROFILE_SAMPLE_RATE), or any invocation whose event carries "profile": true,
+runs under cProfile and optionally tracemalloc. Each profiled invocation
+writes two artifacts keyed by request id:
+
+    {prefix}/{handler}/{request_id}.pstats   # cProfile stats (Profile.dump_stats format)
+    {prefix}/{handler}/{request_id}.json     # duration, tracemalloc peak/top allocators
+
+to S3 when PROFILE_S3_BUCKET is set, otherwise under PROFILE_DIR (/tmp).
+When nothing is sampled the wrapper costs one dict lookup.
+
+cProfile only sees the thread that enabled it. On Python < 3.12 threads
+started during a profiled invocation (e.g. hedged Bedrock calls) get their
+own profiler, merged into the artifact once the thread exits. Threads still
+running when the handler returns are counted in "threads_unprofiled". On
+3.12+ cProfile observes every thread itself.
+
+Aggregate many artifacts locally with:
+
+    python -m lambdas.shared.profiling /path/to/profiles [s3://bucket/prefix ...]
+"""
+
+import argparse
+import cProfile
+import functools
+import glob
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from percentiles import nearest_rank
+except ModuleNotFoundError as e:  # imported as a package (tests / local runs / CLI)
+    if e.name != "percentiles":
+        raise
+    from lambdas.shared.percentiles import nearest_rank
+
+
+class ProfilingConfig:
+    """Sampling and output settings for `profiled`."""
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        trace_memory: bool = False,
+        top_n: int = 25,
+        s3_bucket: Optional[str] = None,
+        s3_prefix: str = "profiles",
+        local_dir: str = "/tmp/gaia-profiles",
+    ):
+        self.sample_rate = sample_rate
+        self.trace_memory = trace_memory
+        self.top_n = top_n
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix
+        self.local_dir = local_dir
+
+    @classmethod
+    def from_env(cls) -> "ProfilingConfig":
+        """Build the config from PROFILE_* environment variables."""
+        trace_memory = os.environ.get("PROFILE_TRACEMALLOC", "false").lower()
+        return cls(
+            sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+            trace_memory=trace_memory in ("1", "true", "yes"),
+            top_n=int(os.environ.get("PROFILE_TOP_N", "25")),
+            s3_bucket=os.environ.get("PROFILE_S3_BUCKET") or None,
+            s3_prefix=os.environ.get("PROFILE_S3_PREFIX", "profiles"),
+            local_dir=os.environ.get("PROFILE_DIR", "/tmp/gaia-profiles"),
+        )
+
+    def should_profile(self, event: Any) -> bool:
+        if isinstance(event, dict) and event.get("profile"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+def _write_artifacts(
+    config: ProfilingConfig, name: str, request_id: str, stats: pstats.Stats, meta: Dict[str, Any]
+) -> str:
+    """Persist the profile pair and return where it went."""
+    directory = os.path.join(config.local_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, request_id)
+    stats.dump_stats(f"{base}.pstats")
+    with open(f"{base}.json", "w") as f:
+        json.dump(meta, f, separators=(",", ":"))
+
+    if not config.s3_bucket:
+        return base
+
+    import boto3
+
+    s3 = boto3.client("s3")
+    key = f"{config.s3_prefix}/{name}/{request_id}"
+    s3.upload_file(f"{base}.pstats", config.s3_bucket, f"{key}.pstats")
+    s3.upload_file(
+        f"{base}.json",
+        config.s3_bucket,
+        f"{key}.json",
+        ExtraArgs={"ContentType": "application/json"},
+    )
+    # /tmp is shared with the handler across warm invocations; don't let profiles pile up
+    os.remove(f"{base}.pstats")
+    os.remove(f"{base}.json")
+    return f"s3://{config.s3_bucket}/{key}"
+
+
+class _ThreadProfilers:
+    """Start a cProfile.Profile in each thread created while profiling is active."""
+
+    # Python 3.12+ implements cProfile on sys.monitoring, which already sees every thread
+    needed = sys.version_info < (3, 12)
+
+    def __init__(self):
+        self.profilers = []
+
+    def _hook(self, frame, event, arg):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        self.profilers.append((threading.current_thread(), profiler))
+
+    def start(self) -> None:
+        if self.needed:
+            threading.setprofile(self._hook)
+
+    def stop(self) -> Tuple[List[cProfile.Profile], int]:
+        """
+        Return profilers of threads that have exited, plus a count of those still running.
+
+        Never waits on live threads: a discarded hedge request would otherwise
+        add its remaining latency to the invocation being profiled.
+        """
+        if self.needed:
+            threading.setprofile(None)
+        finished, unprofiled = [], 0
+        for thread, profiler in self.profilers:
+            if thread.is_alive():
+                unprofiled += 1
+            else:
+                profiler.create_stats()
+                finished.append(profiler)
+        return finished, unprofiled
+
+
+def _save_profile(
+    config: ProfilingConfig,
+    name: str,
+    request_id: str,
+    profiler: cProfile.Profile,
+    threads: _ThreadProfilers,
+    trace_memory: bool,
+    duration_ms: float,
+    error: Optional[str],
+) -> str:
+    """Collect everything recorded for one invocation and write it out."""
+    try:
+        thread_profilers, threads_unprofiled = threads.stop()
+        meta = {
+            "handler": name,
+            "request_id": request_id,
+            "ts": time.time(),
+            "duration_ms": round(duration_ms, 3),
+            "error": error,
+            "threads_profiled": len(thread_profilers),
+            "threads_unprofiled": threads_unprofiled,
+        }
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            meta["tracemalloc_peak_bytes"] = peak
+            meta["top_allocators"] = [
+                {
+                    "location": str(stat.traceback[0]),
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[: config.top_n]
+            ]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    stats = pstats.Stats(profiler, *thread_profilers)
+    return _write_artifacts(config, name, request_id, stats, meta)
+
+
+def profiled(name: str, config: Optional[ProfilingConfig] = None) -> Callable:
+    """Decorate a `lambda_handler(event, context)` with sampled profiling."""
+    config = config or ProfilingConfig.from_env()
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not config.should_profile(event):
+                return handler(event, context)
+
+            request_id = getattr(context, "aws_request_id", None) or str(uuid.uuid4())
+            trace_memory = config.trace_memory and not tracemalloc.is_tracing()
+            if trace_memory:
+                tracemalloc.start()
+            profiler = cProfile.Profile()
+            threads = _ThreadProfilers()
+            threads.start()
+            start = time.perf_counter()
+            error = None
+            try:
+                profiler.enable()
+                return handler(event, context)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                profiler.disable()
+                duration_ms = (time.perf_counter() - start) * 1000.0
+                # Never let profiling bookkeeping replace the handler's result or exception
+                try:
+                    location = _save_profile(
+                        config,
+                        name,
+                        request_id,
+                        profiler,
+                        threads,
+                        trace_memory,
+                        duration_ms,
+                        error,
+                    )
+                    print(
+                        json.dumps(
+                            {
+                                "stage": "profile_written",
+                                "location": location,
+                                "duration_ms": round(duration_ms, 3),
+                            }
+                        )
+                    )
+                except Exception as e:
+                    print(
+                        json.dumps(
+                            {
+                                "stage": "profile_error",
+                                "error_type": type(e).__name__,
+                                "error": str(e),
+                            }
+                        )
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+def _download_s3(uri: str, dest: str) -> str:
+    import boto3
+
+    bucket, _, prefix = uri[len("s3://") :].partition("/")
+    s3 = boto3.client("s3")
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith((".pstats", ".json")):
+                path = os.path.join(dest, key.replace("/", "_"))
+                s3.download_file(bucket, key, path)
+    return dest
+
+
+def aggregate(
+    paths: List[str], sort: str = "cumulative", top_n: int = 30, handler: Optional[str] = None
+) -> str:
+    """Combine profile artifacts found under `paths` into a text hot-path report."""
+    stats_files = []
+    for path in paths:
+        pattern = os.path.join(path, "**", "*.pstats") if os.path.isdir(path) else path
+        stats_files.extend(
+            f for f in sorted(glob.glob(pattern, recursive=True)) if f.endswith(".pstats")
+        )
+
+    combined = None
+    metas = []
+    for f in stats_files:
+        meta_path = f[: -len(".pstats")] + ".json"
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        if handler is not None and meta.get("handler") != handler:
+            continue
+        metas.append(meta)
+        if combined is None:
+            combined = pstats.Stats(f)
+        else:
+            combined.add(f)
+
+    report = io.StringIO()
+    report.write(f"Profiles: {len(metas)}\n")
+    if combined is None:
+        return report.getvalue()
+
+    durations = [m["duration_ms"] for m in metas if "duration_ms" in m]
+    if durations:
+        report.write(
+            "Duration ms: p50={:.1f} p95={:.1f} max={:.1f}\n".format(
+                nearest_rank(durations, 50), nearest_rank(durations, 95), max(durations)
+            )
+        )
+    unprofiled = sum(m.get("threads_unprofiled", 0) for m in metas)
+    if unprofiled:
+        report.write(f"Threads still running at return (not profiled): {unprofiled}\n")
+    errors = sum(1 for m in metas if m.get("error"))
+    if errors:
+        report.write(f"Errored invocations: {errors}\n")
+
+    peaks = [m["tracemalloc_peak_bytes"] for m in metas if "tracemalloc_peak_bytes" in m]
+    if peaks:
+        report.write(f"tracemalloc peak bytes: max={max(peaks)} mean={sum(peaks) // len(peaks)}\n")
+        allocators: Dict[str, int] = {}
+        for m in metas:
+            for entry in m.get("top_allocators", []):
+                allocators[entry["location"]] = (
+                    allocators.get(entry["location"], 0) + entry["size_bytes"]
+                )
+        report.write("\nTop allocators (summed bytes):\n")
+        for location, size in sorted(allocators.items(), key=lambda kv: -kv[1])[:top_n]:
+            report.write(f"  {size:>12}  {location}\n")
+
+    report.write("\n")
+    combined.stream = report
+    combined.strip_dirs().sort_stats(sort).print_stats(top_n)
+    return report.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Aggregate GAIA Lambda profiles into a hot-path report."
+    )
+    parser.add_argument("sources", nargs="+", help="Directories, files or s3://bucket/prefix URIs")
+    parser.add_argument(
+        "--sort", default="cumulative", help="pstats sort key (default: cumulative)"
+    )
+    parser.add_argument("--top", type=int, default=30, help="Rows to show (default: 30)")
+    parser.add_argument(
+        "--handler", help="Only include profiles from this handler (ingest, narrative)"
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [
+            _download_s3(src, tempfile.mkdtemp(dir=tmp)) if src.startswith("s3://") else src
+            for src in args.sources
+        ]
+        sys.stdout.write(aggregate(paths, sort=args.sort, top_n=args.top, handler=args.handler))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
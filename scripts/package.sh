@@ -31,6 +31,9 @@ package() {
   # Copy source files
   cp -R "$SRC/"* "$TMP/"
   
+  # Copy shared modules (profiling hooks)
+  cp -R "$ROOT/lambdas/shared/"* "$TMP/"
+  
   # Create zip
   (cd "$TMP" && zip -r "$OUT" . >/dev/null)
   
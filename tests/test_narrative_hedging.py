@@ -0,0 +1,262 @@
+"""
+Test suite for hedged Bedrock requests
+"""
+
+import io
+import json
+import os
+import random
+import time
+
+import pytest
+
+from moto import mock_aws
+import boto3
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from lambdas.narrative import handler
+from lambdas.narrative.hedging import HedgingPolicy, LatencyTracker
+
+PRIMARY = "anthropic.claude-3-sonnet-20240229-v1:0"
+FALLBACK = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+class FakeBedrockClient:
+    """Bedrock stand-in whose invoke_model latency is drawn from a per-model distribution."""
+
+    def __init__(self, latency, fail_models=()):
+        # latency: {model_id: callable() -> seconds}
+        self.latency = latency
+        self.fail_models = set(fail_models)
+        self.calls = []
+
+    def invoke_model(self, modelId, contentType, accept, body):
+        self.calls.append(modelId)
+        time.sleep(self.latency[modelId]())
+        if modelId in self.fail_models:
+            raise RuntimeError(f"{modelId} throttled")
+        payload = {"content": [{"type": "text", "text": f"narrative from {modelId}"}]}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+
+def bedrock_call(monkeypatch, client):
+    """Point the handler at `client` and return a call that goes through invoke_bedrock."""
+    monkeypatch.setattr(handler, "bedrock", client)
+    return lambda model_id: handler.invoke_bedrock(model_id, "{}")
+
+
+def text_of(result):
+    return result["content"][0]["text"]
+
+
+def test_latency_tracker_percentile():
+    """Test nearest-rank percentile over the window."""
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(95) is None
+
+    for ms in range(1, 101):
+        tracker.record(ms / 1000.0)
+
+    assert tracker.percentile(50) == pytest.approx(0.050)
+    assert tracker.percentile(95) == pytest.approx(0.095)
+    assert tracker.percentile(100) == pytest.approx(0.100)
+
+
+def test_disabled_policy_never_hedges(monkeypatch):
+    """Test that the default policy calls the primary model only."""
+    client = FakeBedrockClient({PRIMARY: lambda: 0.05})
+    policy = HedgingPolicy(fallback_model_id=FALLBACK, initial_delay_s=0.001)
+
+    call = bedrock_call(monkeypatch, client)
+    result, model_id = policy.invoke(call, PRIMARY)
+
+    assert model_id == PRIMARY
+    assert text_of(result) == f"narrative from {PRIMARY}"
+    assert client.calls == [PRIMARY]
+    assert policy.stats() == {"requests": 1, "hedges_issued": 0, "hedges_won": 0}
+
+
+def test_slow_primary_is_hedged_to_fallback(monkeypatch):
+    """Test that a slow primary triggers a hedge which wins."""
+    client = FakeBedrockClient({PRIMARY: lambda: 0.5, FALLBACK: lambda: 0.01})
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.02, max_hedge_pct=100
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    start = time.monotonic()
+    result, model_id = policy.invoke(call, PRIMARY)
+    elapsed = time.monotonic() - start
+
+    assert model_id == FALLBACK
+    assert text_of(result) == f"narrative from {FALLBACK}"
+    assert elapsed < 0.4
+    assert policy.stats() == {"requests": 1, "hedges_issued": 1, "hedges_won": 1}
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    """Test that a primary finishing before the delay is returned directly."""
+    client = FakeBedrockClient({PRIMARY: lambda: 0.01, FALLBACK: lambda: 0.01})
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.5, max_hedge_pct=100
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    _, model_id = policy.invoke(call, PRIMARY)
+
+    assert model_id == PRIMARY
+    assert client.calls == [PRIMARY]
+    assert policy.stats()["hedges_issued"] == 0
+
+
+def test_hedge_reuses_primary_model_without_fallback(monkeypatch):
+    """Test that the hedge targets the same model when no fallback is configured."""
+    latencies = iter([0.5, 0.01])
+    client = FakeBedrockClient({PRIMARY: lambda: next(latencies)})
+    policy = HedgingPolicy(enabled=True, initial_delay_s=0.02, max_hedge_pct=100)
+
+    call = bedrock_call(monkeypatch, client)
+    _, model_id = policy.invoke(call, PRIMARY)
+
+    assert model_id == PRIMARY
+    assert client.calls == [PRIMARY, PRIMARY]
+    assert policy.stats()["hedges_won"] == 1
+
+
+def test_failed_hedge_falls_back_to_primary(monkeypatch):
+    """Test that a failing hedge does not mask a successful primary."""
+    client = FakeBedrockClient(
+        {PRIMARY: lambda: 0.1, FALLBACK: lambda: 0.01}, fail_models=[FALLBACK]
+    )
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.02, max_hedge_pct=100
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    result, model_id = policy.invoke(call, PRIMARY)
+
+    assert model_id == PRIMARY
+    assert text_of(result) == f"narrative from {PRIMARY}"
+    assert policy.stats() == {"requests": 1, "hedges_issued": 1, "hedges_won": 0}
+
+
+def test_all_attempts_failing_raises_primary_error(monkeypatch):
+    """Test that the primary's exception surfaces when both attempts fail."""
+    client = FakeBedrockClient(
+        {PRIMARY: lambda: 0.1, FALLBACK: lambda: 0.01}, fail_models=[PRIMARY, FALLBACK]
+    )
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.02, max_hedge_pct=100
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    with pytest.raises(RuntimeError, match=PRIMARY):
+        policy.invoke(call, PRIMARY)
+
+
+def test_hedge_budget_caps_percentage_of_traffic(monkeypatch):
+    """Test that hedges stay within max_hedge_pct of requests."""
+    client = FakeBedrockClient({PRIMARY: lambda: 0.03, FALLBACK: lambda: 0.001})
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.005, max_hedge_pct=25
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    for _ in range(12):
+        policy.invoke(call, PRIMARY)
+
+    stats = policy.stats()
+    assert stats["requests"] == 12
+    assert stats["hedges_issued"] == 3
+    assert stats["hedges_won"] <= stats["hedges_issued"]
+
+
+def test_hedge_delay_tracks_percentile(monkeypatch):
+    """Test that the delay follows observed latency once enough samples exist."""
+    rng = random.Random(7)
+    # Mostly fast, with an occasional long tail
+    client = FakeBedrockClient({PRIMARY: lambda: 0.04 if rng.random() < 0.1 else 0.002})
+    policy = HedgingPolicy(percentile=50, initial_delay_s=1.0, min_samples=10)
+
+    call = bedrock_call(monkeypatch, client)
+    assert policy.hedge_delay(PRIMARY) == 1.0
+    for _ in range(20):
+        policy.invoke(call, PRIMARY)
+
+    assert policy.hedge_delay(PRIMARY) < 0.04
+
+
+def test_pending_loser_records_censored_latency(monkeypatch):
+    """Test that a still-running loser is recorded at its elapsed time, not its finish time."""
+    latencies = iter([0.5, 0.01])
+    client = FakeBedrockClient({PRIMARY: lambda: next(latencies)})
+    policy = HedgingPolicy(enabled=True, initial_delay_s=0.05, max_hedge_pct=100)
+
+    call = bedrock_call(monkeypatch, client)
+    policy.invoke(call, PRIMARY)
+    time.sleep(0.6)  # let the loser finish after invoke has returned
+
+    tracker = policy.tracker(PRIMARY)
+    assert tracker.count() == 2
+    # Winner ~0.01s; the loser is censored at ~0.06s instead of its real 0.5s
+    assert tracker.percentile(0) < 0.05
+    assert 0.05 <= tracker.percentile(100) < 0.3
+
+
+def test_fallback_latency_does_not_move_primary_percentile(monkeypatch):
+    """Test that latencies are tracked per model."""
+    client = FakeBedrockClient({PRIMARY: lambda: 0.1, FALLBACK: lambda: 0.001})
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.02, max_hedge_pct=100
+    )
+
+    call = bedrock_call(monkeypatch, client)
+    policy.invoke(call, PRIMARY)
+
+    assert policy.tracker(FALLBACK).percentile(100) < 0.02
+    assert policy.tracker(PRIMARY).percentile(100) >= 0.02
+    assert policy.hedge_delay(PRIMARY) == 0.02
+
+
+@mock_aws
+def test_lambda_handler_hedges_slow_bedrock(monkeypatch, capsys):
+    """Test the narrative handler end to end with hedging enabled."""
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="test-gaia-bucket")
+    diary = {"region_id": "reef_sumatra", "features": {}, "events": []}
+    s3.put_object(
+        Bucket="test-gaia-bucket",
+        Key="diary/reef_sumatra/test.json",
+        Body=json.dumps(diary).encode("utf-8"),
+    )
+    monkeypatch.setattr(handler, "s3", s3)
+    monkeypatch.setenv("BEDROCK_MODEL_ID", PRIMARY)
+
+    client = FakeBedrockClient({PRIMARY: lambda: 0.5, FALLBACK: lambda: 0.01})
+    policy = HedgingPolicy(
+        enabled=True, fallback_model_id=FALLBACK, initial_delay_s=0.02, max_hedge_pct=100
+    )
+    monkeypatch.setattr(handler, "bedrock", client)
+    monkeypatch.setattr(handler, "hedging", policy)
+
+    result = handler.lambda_handler(
+        {
+            "region_id": "reef_sumatra",
+            "s3_bucket": "test-gaia-bucket",
+            "s3_key": "diary/reef_sumatra/test.json",
+        },
+        None,
+    )
+
+    assert result["narrative"] == f"narrative from {FALLBACK}"
+    assert client.calls == [PRIMARY, FALLBACK]
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    hedge_log = next(log for log in logs if log["stage"] == "bedrock_hedging")
+    assert hedge_log == {
+        "stage": "bedrock_hedging",
+        "model": FALLBACK,
+        "requests": 1,
+        "hedges_issued": 1,
+        "hedges_won": 1,
+    }
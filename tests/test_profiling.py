@@ -0,0 +1,246 @@
+"""
+Test suite for Lambda profiling hooks
+"""
+
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from lambdas.shared import profiling
+from lambdas.shared.profiling import ProfilingConfig, aggregate, main, profiled
+
+
+def busy_handler(event, context):
+    """Stand-in handler doing a little JSON work."""
+    payload = [{"i": i, "text": "x" * 50} for i in range(2000)]
+    return {"status": "ok", "size": len(json.dumps(payload))}
+
+
+def failing_handler(event, context):
+    raise ValueError("boom")
+
+
+def threaded_handler(event, context):
+    """Stand-in handler doing its work on an executor thread, like hedged Bedrock calls."""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(busy_handler, event, context).result()
+
+
+def make_context(request_id):
+    return types.SimpleNamespace(aws_request_id=request_id)
+
+
+def test_disabled_profiling_writes_nothing(tmp_path):
+    """Test that a zero sample rate passes straight through."""
+    handler = profiled("ingest", ProfilingConfig(local_dir=str(tmp_path)))(busy_handler)
+
+    result = handler({"region_id": "reef_sumatra"}, make_context("req-1"))
+
+    assert result["status"] == "ok"
+    assert handler.__name__ == "busy_handler"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_event_flag_forces_profile(tmp_path):
+    """Test that "profile": true profiles a single invocation."""
+    handler = profiled("ingest", ProfilingConfig(local_dir=str(tmp_path)))(busy_handler)
+
+    handler({"profile": True}, make_context("req-1"))
+
+    stats_path = tmp_path / "ingest" / "req-1.pstats"
+    meta_path = tmp_path / "ingest" / "req-1.json"
+    assert stats_path.exists()
+    assert meta_path.exists()
+
+    stats = pstats.Stats(str(stats_path)).stats
+    assert any(func == "busy_handler" for _, _, func in stats)
+
+    meta = json.loads(meta_path.read_text())
+    assert meta["handler"] == "ingest"
+    assert meta["request_id"] == "req-1"
+    assert meta["duration_ms"] > 0
+    assert meta["error"] is None
+    assert "tracemalloc_peak_bytes" not in meta
+
+
+def test_sample_rate_one_profiles_every_invocation(tmp_path):
+    """Test sampled profiling with a generated request id when no context is given."""
+    handler = profiled("narrative", ProfilingConfig(sample_rate=1.0, local_dir=str(tmp_path)))(
+        busy_handler
+    )
+
+    handler({}, None)
+    handler({}, None)
+
+    assert len(list((tmp_path / "narrative").glob("*.pstats"))) == 2
+
+
+def test_tracemalloc_records_peak_and_allocators(tmp_path):
+    """Test that memory tracing adds peak and top allocators."""
+    config = ProfilingConfig(trace_memory=True, top_n=5, local_dir=str(tmp_path))
+    handler = profiled("ingest", config)(busy_handler)
+
+    handler({"profile": True}, make_context("req-mem"))
+
+    meta = json.loads((tmp_path / "ingest" / "req-mem.json").read_text())
+    assert meta["tracemalloc_peak_bytes"] > 0
+    assert 0 < len(meta["top_allocators"]) <= 5
+    assert {"location", "size_bytes", "count"} <= set(meta["top_allocators"][0])
+
+
+def test_failing_handler_is_still_profiled(tmp_path):
+    """Test that the original exception propagates and the profile is kept."""
+    handler = profiled("ingest", ProfilingConfig(local_dir=str(tmp_path)))(failing_handler)
+
+    with pytest.raises(ValueError, match="boom"):
+        handler({"profile": True}, make_context("req-err"))
+
+    meta = json.loads((tmp_path / "ingest" / "req-err.json").read_text())
+    assert meta["error"] == "ValueError"
+
+
+def test_write_failure_does_not_fail_invocation(tmp_path):
+    """Test that an unwritable profile directory is logged, not raised."""
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    handler = profiled("ingest", ProfilingConfig(local_dir=str(blocker)))(busy_handler)
+
+    assert handler({"profile": True}, make_context("req-1"))["status"] == "ok"
+
+
+def test_from_env(monkeypatch):
+    """Test PROFILE_* environment parsing."""
+    monkeypatch.setenv("PROFILE_SAMPLE_RATE", "0.05")
+    monkeypatch.setenv("PROFILE_TRACEMALLOC", "true")
+    monkeypatch.setenv("PROFILE_S3_BUCKET", "gaia-profiles")
+
+    config = ProfilingConfig.from_env()
+
+    assert config.sample_rate == 0.05
+    assert config.trace_memory is True
+    assert config.s3_bucket == "gaia-profiles"
+    assert config.s3_prefix == "profiles"
+
+
+def test_aggregate_combines_profiles(tmp_path, capsys):
+    """Test the hot-path report across handlers and invocations."""
+    config = ProfilingConfig(trace_memory=True, local_dir=str(tmp_path))
+    ingest = profiled("ingest", config)(busy_handler)
+    narrative = profiled("narrative", config)(busy_handler)
+    for i in range(3):
+        ingest({"profile": True}, make_context(f"ingest-{i}"))
+    narrative({"profile": True}, make_context("narrative-0"))
+
+    report = aggregate([str(tmp_path)])
+    assert "Profiles: 4" in report
+    assert "Duration ms: p50=" in report
+    assert "Top allocators" in report
+    assert "busy_handler" in report
+
+    assert "Profiles: 1" in aggregate([str(tmp_path)], handler="narrative")
+
+    assert main([str(tmp_path), "--handler", "ingest", "--top", "5"]) == 0
+    assert "Profiles: 3" in capsys.readouterr().out
+
+
+def test_aggregate_empty_directory(tmp_path):
+    """Test that an empty source yields an empty report."""
+    assert aggregate([str(tmp_path)]) == "Profiles: 0\n"
+    assert not os.listdir(tmp_path)
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="cProfile sees all threads on 3.12+")
+def test_worker_threads_are_profiled(tmp_path):
+    """Test that work done on executor threads lands in the profile."""
+    handler = profiled("narrative", ProfilingConfig(local_dir=str(tmp_path)))(threaded_handler)
+
+    handler({"profile": True}, make_context("req-thread"))
+
+    stats = pstats.Stats(str(tmp_path / "narrative" / "req-thread.pstats")).stats
+    assert any(func == "busy_handler" for _, _, func in stats)
+    meta = json.loads((tmp_path / "narrative" / "req-thread.json").read_text())
+    assert meta["threads_profiled"] == 1
+    assert meta["threads_unprofiled"] == 0
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason="cProfile sees all threads on 3.12+")
+def test_threads_still_running_are_counted(tmp_path):
+    """Test that threads outliving the handler are reported, not waited on."""
+    release = threading.Event()
+
+    def handler_with_stragglers(event, context):
+        for _ in range(3):
+            threading.Thread(target=release.wait, daemon=True).start()
+        return {"status": "ok"}
+
+    handler = profiled("narrative", ProfilingConfig(local_dir=str(tmp_path)))(
+        handler_with_stragglers
+    )
+    start = time.perf_counter()
+    try:
+        handler({"profile": True}, make_context("req-straggler"))
+        elapsed = time.perf_counter() - start
+    finally:
+        release.set()
+
+    meta = json.loads((tmp_path / "narrative" / "req-straggler.json").read_text())
+    assert meta["threads_profiled"] == 0
+    assert meta["threads_unprofiled"] == 3
+    assert meta["duration_ms"] < 50
+    assert elapsed < 0.25
+    assert "Threads still running at return" in aggregate([str(tmp_path)])
+
+
+@mock_aws
+def test_profile_uploaded_to_s3(tmp_path, monkeypatch):
+    """Test that artifacts go to S3 and the /tmp copies are removed."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="test-gaia-bucket")
+    config = ProfilingConfig(s3_bucket="test-gaia-bucket", local_dir=str(tmp_path))
+    handler = profiled("ingest", config)(busy_handler)
+
+    handler({"profile": True}, make_context("req-s3"))
+
+    keys = {obj["Key"] for obj in s3.list_objects_v2(Bucket="test-gaia-bucket")["Contents"]}
+    assert keys == {"profiles/ingest/req-s3.pstats", "profiles/ingest/req-s3.json"}
+    assert list((tmp_path / "ingest").iterdir()) == []
+
+
+def test_bookkeeping_failure_keeps_handler_result(tmp_path, monkeypatch):
+    """Test that errors collecting the profile never replace the handler's outcome."""
+
+    def broken_stop(self):
+        raise RuntimeError("stop failed")
+
+    monkeypatch.setattr(profiling._ThreadProfilers, "stop", broken_stop)
+    config = ProfilingConfig(trace_memory=True, local_dir=str(tmp_path))
+
+    assert profiled("ingest", config)(busy_handler)({"profile": True}, None)["status"] == "ok"
+    with pytest.raises(ValueError, match="boom"):
+        profiled("ingest", config)(failing_handler)({"profile": True}, None)
+    assert not tracemalloc.is_tracing()
+    threading.setprofile(None)  # the real stop() would have removed the hook
+
+
+def test_snapshot_failure_keeps_handler_result(tmp_path, monkeypatch):
+    """Test that a tracemalloc failure is logged rather than raised."""
+
+    def broken_snapshot():
+        raise RuntimeError("snapshot failed")
+
+    monkeypatch.setattr(tracemalloc, "take_snapshot", broken_snapshot)
+    config = ProfilingConfig(trace_memory=True, local_dir=str(tmp_path))
+
+    assert profiled("ingest", config)(busy_handler)({"profile": True}, None)["status"] == "ok"
+    assert not tracemalloc.is_tracing()